@@ -0,0 +1,163 @@
+"""
+REFORMMED Anomaly Model — Streaming per-machine, per-metric baselines with Postgres checkpoints
+"""
+import logging, os
+import numpy as np
+
+log = logging.getLogger("anomaly")
+
+# Weights are per sample; agents send every second by default
+ALPHA          = float(os.getenv("ANOMALY_ALPHA", "0.02"))          # fast EWMA mean, ~1 min
+VAR_ALPHA      = float(os.getenv("ANOMALY_VAR_ALPHA", "0.002"))     # slower variance keeps z-scores from being heavy-tailed
+SEASON_ALPHA   = float(os.getenv("ANOMALY_SEASON_ALPHA", "0.0001")) # per hour-of-day slot, ~3 days
+Z_THRESHOLD    = float(os.getenv("ANOMALY_Z", "4"))
+CONSECUTIVE    = int(os.getenv("ANOMALY_CONSECUTIVE", "3"))        # exceedances in a row before flagging
+WARMUP         = 60     # samples before the EWMA baseline is trusted
+SEASON_WARMUP  = 120    # samples per hour slot before that slot is trusted
+MIN_STD        = 1.0    # percent / °C — keeps flat series from producing huge z-scores
+MAX_ROWS       = 120    # new rows folded per machine per pass; a backlog catches up over passes
+
+# metric -> SQL expression over a machine table row
+METRICS = {
+    "cpu_percent": "cpu_percent",
+    "ram_percent": "ram_percent",
+    "cpu_temp":    "NULLIF(cpu_temp, 0)",
+    "gpu_percent": "(gpu_info->0->>'gpu_percent')::float",
+    "gpu_temp":    "NULLIF((gpu_info->0->>'temp_c')::float, 0)",
+}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS anomaly_state (
+        table_name TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        samples BIGINT,
+        mean FLOAT,
+        var FLOAT,
+        season_samples INT[],
+        season_mean FLOAT[],
+        season_var FLOAT[],
+        updated_at TIMESTAMPTZ DEFAULT NOW(),
+        PRIMARY KEY (table_name, metric)
+    );
+"""
+
+# Separate statement: alert_history comes from the migration and may not exist yet
+ALERT_HISTORY_Z = """
+    DO $$ BEGIN
+        IF to_regclass('alert_history') IS NOT NULL THEN
+            ALTER TABLE alert_history ADD COLUMN IF NOT EXISTS z_score FLOAT;
+        END IF;
+    END $$;
+"""
+
+class StreamingBaselines:
+    """
+    Fixed-size state per (machine, metric): EWMA mean/variance plus 24 hour-of-day slots.
+    State lives in flat NumPy arrays so one update call scores and folds in the whole fleet.
+    """
+
+    def __init__(self, capacity=1024, alpha=ALPHA, var_alpha=VAR_ALPHA, season_alpha=SEASON_ALPHA):
+        self.alpha, self.var_alpha, self.season_alpha = alpha, var_alpha, season_alpha
+        self.index, self.keys = {}, []
+        self._alloc(capacity)
+
+    def _alloc(self, n):
+        old = getattr(self, "count", None)
+        new = {
+            "count": np.zeros(n, np.int64), "mean": np.zeros(n), "var": np.zeros(n),
+            "s_count": np.zeros((n, 24), np.int32), "s_mean": np.zeros((n, 24)), "s_var": np.zeros((n, 24)),
+            "streak": np.zeros(n, np.int32),
+        }
+        if old is not None:
+            for name, arr in new.items():
+                arr[:len(old)] = getattr(self, name)
+        self.__dict__.update(new)
+
+    def slot(self, key):
+        i = self.index.get(key)
+        if i is None:
+            i = self.index[key] = len(self.keys)
+            self.keys.append(key)
+            if i >= len(self.count):
+                self._alloc(2 * len(self.count))
+        return i
+
+    def update(self, idx, values, hours):
+        """
+        Score then fold in one sample per slot (idx must be unique within a call).
+        Returns (score, fire): the larger of the EWMA and hour-of-day z-scores, and whether
+        this sample completes a run of CONSECUTIVE exceedances of Z_THRESHOLD.
+        """
+        x = np.asarray(values, dtype=float)
+        h = np.asarray(hours, dtype=np.intp)
+
+        mean, var, count = self.mean[idx], self.var[idx], self.count[idx]
+        z = np.where(count >= WARMUP, (x - mean) / np.sqrt(np.maximum(var, MIN_STD ** 2)), 0.0)
+
+        s_mean, s_var, s_count = self.s_mean[idx, h], self.s_var[idx, h], self.s_count[idx, h]
+        z_season = np.where(s_count >= SEASON_WARMUP,
+                            (x - s_mean) / np.sqrt(np.maximum(s_var, MIN_STD ** 2)), 0.0)
+
+        score = np.where(np.abs(z_season) > np.abs(z), z_season, z)
+        streak = np.where(np.abs(score) >= Z_THRESHOLD, self.streak[idx] + 1, 0)
+        self.streak[idx] = streak
+
+        self.mean[idx], self.var[idx] = _ewma(mean, var, count, x, self.alpha, self.var_alpha)
+        self.count[idx] = count + 1
+        self.s_mean[idx, h], self.s_var[idx, h] = _ewma(s_mean, s_var, s_count, x,
+                                                        self.season_alpha, self.season_alpha)
+        self.s_count[idx, h] = s_count + 1
+        return score, streak == CONSECUTIVE
+
+    def rows(self):
+        """Checkpoint rows for anomaly_state"""
+        return [(T, m, int(self.count[i]), float(self.mean[i]), float(self.var[i]),
+                 self.s_count[i].tolist(), self.s_mean[i].tolist(), self.s_var[i].tolist())
+                for i, (T, m) in enumerate(self.keys)]
+
+    def restore(self, records):
+        for r in records:
+            i = self.slot((r["table_name"], r["metric"]))
+            self.count[i], self.mean[i], self.var[i] = r["samples"], r["mean"], r["var"]
+            self.s_count[i], self.s_mean[i], self.s_var[i] = r["season_samples"], r["season_mean"], r["season_var"]
+
+def _ewma(mean, var, count, x, alpha, var_alpha):
+    """
+    Incremental exponentially weighted mean/variance. Weights start at 1/(n+1) — a plain
+    running mean/variance — and settle at alpha / var_alpha, so a fresh baseline isn't
+    biased towards zero variance.
+    """
+    a = np.maximum(alpha, 1.0 / (count + 1))
+    av = np.maximum(var_alpha, 1.0 / (count + 1))
+    d = x - mean
+    new_mean = mean + a * d
+    return new_mean, (1 - av) * var + av * d * (x - new_mean)
+
+async def ensure_schema(conn):
+    await conn.execute(SCHEMA)
+    await conn.execute(ALERT_HISTORY_Z)
+
+async def load(conn, model):
+    model.restore(await conn.fetch("SELECT * FROM anomaly_state"))
+    log.info(f"✅ Restored {len(model.keys)} anomaly baselines")
+
+async def checkpoint(conn, model):
+    await conn.executemany("""
+        INSERT INTO anomaly_state (table_name, metric, samples, mean, var,
+                                   season_samples, season_mean, season_var, updated_at)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, NOW())
+        ON CONFLICT (table_name, metric) DO UPDATE SET
+            samples = EXCLUDED.samples, mean = EXCLUDED.mean, var = EXCLUDED.var,
+            season_samples = EXCLUDED.season_samples, season_mean = EXCLUDED.season_mean,
+            season_var = EXCLUDED.season_var, updated_at = NOW()
+    """, model.rows())
+
+def new_rows_sql(tables):
+    """
+    Rows newer than each machine's watermark in one round trip; branch i reads $i+1.
+    Each branch is an index range scan on ts, oldest first, capped at MAX_ROWS.
+    """
+    cols = ", ".join(f"{expr} AS {m}" for m, expr in METRICS.items())
+    return " UNION ALL ".join(
+        f"(SELECT '{T}' AS table_name, ts, {cols} FROM {T} WHERE ts > ${i + 1} ORDER BY ts LIMIT {MAX_ROWS})"
+        for i, T in enumerate(tables))
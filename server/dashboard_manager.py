@@ -1,5 +1,5 @@
 """
-REFORMMED Dashboard Manager — Auto-creates Grafana dashboards for each machine
+REFORMMED Dashboard Manager — Templated machine dashboard, with optional per-machine dashboards
 COMPLETE VERSION with all panels working
 """
 import asyncio, logging, base64, urllib.request, json, os
@@ -18,8 +18,13 @@ GRAFANA_URL  = os.getenv("GRAFANA_URL", "http://reformmed_grafana:3000")
 GRAFANA_USER = os.getenv("GRAFANA_USER", "admin")
 GRAFANA_PASS = os.getenv("GRAFANA_PASS", "monitor2345")
 DS_UID       = "PCC52D03280B7034C"
+TEMPLATE_UID = "reformmed-machine"
 
-known_machines = set()
+# "templated" — one dashboard with $location/$machine variables (default)
+# "per_machine" — one dashboard per machine (legacy), "both" — build both
+DASHBOARD_MODE = os.getenv("DASHBOARD_MODE", "templated")
+
+known_machines = {}   # table_name -> settings_version() last pushed
 
 def gapi(path, method="GET", data=None):
     """Call Grafana API"""
@@ -41,11 +46,13 @@ def gapi(path, method="GET", data=None):
         log.error(f"Grafana {method} {path} → {e}")
         return None
 
-def create_dashboard(table_name, system_name, location):
-    """Create individual machine dashboard with ALL panels working"""
-    T = table_name
-    uid = f"mach-{T}"[:40]
-    title = f"🖥 {system_name} — {location}"
+# Panels hidden by dashboard_settings visibility flags (per-machine mode only)
+GPU_PANELS     = {15, 16, 17, 18, 19, 24}
+NETWORK_PANELS = {11, 12, 22}
+PROCESS_PANELS = {26}
+
+def machine_panels(T, name_sql):
+    """All machine panels; T is a table name or the $machine template variable"""
     DS = {"type": "grafana-postgresql-datasource", "uid": DS_UID}
 
     def ts(r, sql):
@@ -76,7 +83,7 @@ def create_dashboard(table_name, system_name, location):
         {"id":4,"type":"stat","title":"💻 Machine Name","gridPos":{"x":12,"y":0,"w":4,"h":3},"datasource":DS,
          "options":{"reduceOptions":{"calcs":["lastNotNull"]},"colorMode":"background","graphMode":"none"},
          "fieldConfig":{"defaults":{"color":{"mode":"thresholds"},"thresholds":{"mode":"absolute","steps":[{"color":"dark-blue","value":None}]}}},
-         "targets":[tb(f"SELECT ts as time, '{system_name}' as value FROM {T} ORDER BY ts DESC LIMIT 1")]},
+         "targets":[tb(f"SELECT ts as time, {name_sql} as value FROM {T} ORDER BY ts DESC LIMIT 1")]},
 
         {"id":5,"type":"stat","title":"📦 RAM Total","gridPos":{"x":16,"y":0,"w":4,"h":3},"datasource":DS,
          "options":{"reduceOptions":{"calcs":["lastNotNull"]},"colorMode":"background","graphMode":"none"},
@@ -204,35 +211,89 @@ def create_dashboard(table_name, system_name, location):
          "fieldConfig":{"defaults":{"custom":{"displayMode":"auto"}},"overrides":[
              {"matcher":{"id":"byName","options":"Used %"},"properties":[{"id":"custom.displayMode","value":"lcd-gauge"}]}
          ]},
-         "targets":[tb(f"SELECT d->>'mountpoint' as \"Mount\",d->>'device' as \"Device\",(d->>'total_gb')::float as \"Total GB\",(d->>'used_gb')::float as \"Used GB\",(d->>'free_gb')::float as \"Free GB\",(d->>'percent')::float as \"Used %\" FROM {T},jsonb_array_elements(disk_partitions) as d WHERE ts=(SELECT MAX(ts) FROM {T})")]}
+         "targets":[tb(f"SELECT d->>'mountpoint' as \"Mount\",d->>'device' as \"Device\",(d->>'total_gb')::float as \"Total GB\",(d->>'used_gb')::float as \"Used GB\",(d->>'free_gb')::float as \"Free GB\",(d->>'percent')::float as \"Used %\" FROM {T},jsonb_array_elements(disk_partitions) as d WHERE ts=(SELECT MAX(ts) FROM {T})")]},
+
+        {"id":28,"type":"table","title":"⏳ Trend Forecast","gridPos":{"x":0,"y":48,"w":24,"h":6},"datasource":DS,
+         "fieldConfig":{"defaults":{"custom":{"displayMode":"auto"},"decimals":1},"overrides":[
+             {"matcher":{"id":"byName","options":"Hours to Threshold"},"properties":[{"id":"custom.displayMode","value":"color-background"},
+              {"id":"thresholds","value":{"mode":"absolute","steps":[{"color":"red","value":None},{"color":"orange","value":24},{"color":"green","value":168}]}}]}
+         ]},
+         "targets":[tb(f"SELECT metric as \"Metric\",current_value as \"Now\",slope_per_hour as \"Change / h\",threshold as \"Threshold\",hours_to_threshold as \"Hours to Threshold\",hours_to_full as \"Hours to Full\",updated_at as \"Updated\" FROM metric_forecasts WHERE table_name='{T}' ORDER BY hours_to_threshold ASC NULLS LAST")]}
     ]
+    return panels
 
+def push_dashboard(uid, title, panels, refresh="5s", time_from="now-30m", time_to="now", templating=None):
     dashboard = {
         "dashboard": {
             "uid": uid,
             "title": title,
             "tags": ["reformmed","machine"],
             "timezone": "browser",
-            "refresh": "5s",
-            "time": {"from":"now-30m","to":"now"},
+            "refresh": refresh,
+            "time": {"from":time_from,"to":time_to},
             "panels": panels
         },
         "overwrite": True,
         "folderId": 0
     }
+    if templating:
+        dashboard["dashboard"]["templating"] = {"list": templating}
 
     result = gapi("/api/dashboards/db", method="POST", data=dashboard)
     if result and result.get("status") == "success":
         log.info(f"✅ Dashboard created: {result['url']}")
         return True
     else:
-        log.error(f"❌ Failed for {T}: {result}")
+        log.error(f"❌ Failed for {uid}: {result}")
         return False
 
+def create_template_dashboard():
+    """One dashboard for the whole fleet — $location narrows $machine, which picks the table"""
+    DS = {"type": "grafana-postgresql-datasource", "uid": DS_UID}
+    templating = [
+        {"name":"location","label":"Location","type":"query","datasource":DS,
+         "query":"SELECT DISTINCT location FROM machine_registry ORDER BY 1",
+         "refresh":1,"multi":True,"includeAll":True,"current":{"text":"All","value":"$__all"}},
+        {"name":"machine","label":"Machine","type":"query","datasource":DS,
+         "query":"SELECT table_name AS __value, system_name || ' — ' || location AS __text FROM machine_registry WHERE location IN ($location) ORDER BY system_name",
+         "refresh":1,"multi":False,"includeAll":False},
+    ]
+    panels = machine_panels("$machine", "(SELECT system_name FROM machine_registry WHERE table_name='$machine')")
+    return push_dashboard(TEMPLATE_UID, "🖥 Machine — $machine", panels, templating=templating)
+
+def create_dashboard(table_name, system_name, location, settings=None):
+    """Create individual machine dashboard, honouring dashboard_settings panel visibility"""
+    T = table_name
+    settings = settings or {}
+    hidden = set()
+    if settings.get("show_gpu_panels") is False:
+        hidden |= GPU_PANELS
+    if settings.get("show_network_panels") is False:
+        hidden |= NETWORK_PANELS
+    if settings.get("show_process_table") is False:
+        hidden |= PROCESS_PANELS
+    panels = [p for p in machine_panels(T, f"'{system_name}'") if p["id"] not in hidden]
+    return push_dashboard(f"mach-{T}"[:40], f"🖥 {system_name} — {location}", panels,
+                          refresh=settings.get("refresh_interval") or "5s",
+                          time_from=settings.get("time_range_from") or "now-30m",
+                          time_to=settings.get("time_range_to") or "now")
+
 def update_fleet_dashboard(machines):
     """Update fleet overview dashboard"""
     log.info(f"✅ Fleet updated ({len(machines)} machines)")
 
+async def load_dashboard_settings(conn):
+    """All dashboard_settings rows keyed by table_name (empty if the table isn't migrated yet)"""
+    try:
+        rows = await conn.fetch("SELECT * FROM dashboard_settings")
+        return {r["table_name"]: dict(r) for r in rows}
+    except asyncpg.UndefinedTableError:
+        return {}
+
+def settings_version(settings):
+    """Re-push a per-machine dashboard whenever any of its settings (or updated_at) change"""
+    return tuple(sorted((k, str(v)) for k, v in settings.items() if k not in ("id", "table_name")))
+
 async def main():
     log.info("🚀 Dashboard Manager starting...")
     pool = await asyncpg.create_pool(
@@ -240,7 +301,7 @@ async def main():
         user=DB_USER, password=DB_PASS,
         min_size=2, max_size=5
     )
-    log.info("✅ Connected — watching every 15s")
+    log.info(f"✅ Connected — watching every 15s ({DASHBOARD_MODE} mode)")
 
     async with pool.acquire() as conn:
         await conn.execute("""
@@ -260,18 +321,32 @@ async def main():
     log.info("✅ machine_registry ready")
 
     known_machines.clear()
+    template_pushed = False
 
     while True:
         try:
+            # Push once at startup to roll out panel changes, then restore it if deleted in Grafana
+            if DASHBOARD_MODE in ("templated", "both"):
+                if not template_pushed or gapi(f"/api/dashboards/uid/{TEMPLATE_UID}") is None:
+                    template_pushed = create_template_dashboard()
+
             async with pool.acquire() as conn:
                 rows = await conn.fetch("SELECT table_name, system_name, location FROM machine_registry")
                 machines = [(r['table_name'], r['system_name'], r['location']) for r in rows]
 
-                for table_name, system_name, location in machines:
-                    if table_name not in known_machines:
-                        log.info(f"🆕 New machine: {system_name} ({location}) — creating dashboard...")
-                        if create_dashboard(table_name, system_name, location):
-                            known_machines.add(table_name)
+                if DASHBOARD_MODE in ("per_machine", "both"):
+                    all_settings = await load_dashboard_settings(conn)
+                    for table_name, system_name, location in machines:
+                        settings = all_settings.get(table_name, {})
+                        version = settings_version(settings)
+                        if known_machines.get(table_name) == version:
+                            continue
+                        if table_name in known_machines:
+                            log.info(f"🔧 Settings changed: {system_name} ({location}) — updating dashboard...")
+                        else:
+                            log.info(f"🆕 New machine: {system_name} ({location}) — creating dashboard...")
+                        if create_dashboard(table_name, system_name, location, settings):
+                            known_machines[table_name] = version
 
                 update_fleet_dashboard(machines)
 
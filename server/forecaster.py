@@ -0,0 +1,200 @@
+"""
+REFORMMED Forecaster — Projects disk-full and thermal trends for every machine in one vectorized pass
+"""
+import asyncio, logging, os, time
+from datetime import datetime, timezone, timedelta
+import asyncpg
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [FORECAST] %(message)s")
+log = logging.getLogger("forecaster")
+
+DB_HOST = os.getenv("POSTGRES_HOST", "reformmed_postgres")
+DB_PORT = int(os.getenv("POSTGRES_PORT", "5432"))
+DB_NAME = os.getenv("POSTGRES_DB", "monitor_machine")
+DB_USER = os.getenv("POSTGRES_USER", "reformmed")
+DB_PASS = os.getenv("POSTGRES_PASSWORD", "monitor2345")
+
+BUCKET_SECS    = 900                                              # rollup resolution
+LOOKBACK_HOURS = int(os.getenv("FORECAST_LOOKBACK_HOURS", "72"))
+HALFLIFE_HOURS = float(os.getenv("FORECAST_HALFLIFE_HOURS", "24")) # recency weighting of the fit
+MIN_POINTS     = 8
+INTERVAL_SECS  = int(os.getenv("FORECAST_INTERVAL_SECS", "900"))
+DEFAULT_THRESHOLDS = {"disk": 85, "temp": 80}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS metric_rollup (
+        table_name TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        bucket TIMESTAMPTZ NOT NULL,
+        value FLOAT,
+        samples INT,
+        PRIMARY KEY (table_name, metric, bucket)
+    );
+    CREATE INDEX IF NOT EXISTS idx_metric_rollup_bucket ON metric_rollup (bucket);
+
+    CREATE TABLE IF NOT EXISTS metric_forecasts (
+        table_name TEXT NOT NULL,
+        metric TEXT NOT NULL,          -- 'disk:<mountpoint>', 'cpu_temp', 'gpu_temp'
+        current_value FLOAT,
+        slope_per_hour FLOAT,
+        threshold FLOAT,
+        hours_to_threshold FLOAT,      -- NULL when not trending towards it
+        hours_to_full FLOAT,           -- disk only
+        points INT,
+        updated_at TIMESTAMPTZ DEFAULT NOW(),
+        PRIMARY KEY (table_name, metric)
+    );
+"""
+
+# One pass over the new raw rows of a machine table, folded into 15-minute buckets
+ROLLUP_SQL = """
+    INSERT INTO metric_rollup (table_name, metric, bucket, value, samples)
+    SELECT $1, metric, bucket, avg(v), count(*) FROM (
+        SELECT to_timestamp(floor(extract(epoch FROM ts) / {b}) * {b}) AS bucket, 'cpu_temp' AS metric, cpu_temp AS v
+        FROM {T} WHERE ts >= $2 AND ts < $3
+        UNION ALL
+        SELECT to_timestamp(floor(extract(epoch FROM ts) / {b}) * {b}), 'gpu_temp', (gpu_info->0->>'temp_c')::float
+        FROM {T} WHERE ts >= $2 AND ts < $3 AND jsonb_typeof(gpu_info) = 'array'
+        UNION ALL
+        SELECT to_timestamp(floor(extract(epoch FROM ts) / {b}) * {b}), 'disk:' || (d->>'mountpoint'), (d->>'percent')::float
+        FROM {T}, jsonb_array_elements(disk_partitions) AS d
+        WHERE ts >= $2 AND ts < $3 AND jsonb_typeof(disk_partitions) = 'array'
+    ) m
+    WHERE v IS NOT NULL AND v > 0
+    GROUP BY metric, bucket
+    ON CONFLICT (table_name, metric, bucket) DO UPDATE SET value = EXCLUDED.value, samples = EXCLUDED.samples
+"""
+
+async def rollup(pool, tables):
+    """Aggregate only raw rows newer than each machine's last closed bucket"""
+    now = time.time()
+    closed = datetime.fromtimestamp(int(now // BUCKET_SECS) * BUCKET_SECS, timezone.utc)
+    floor = closed - timedelta(hours=LOOKBACK_HOURS)
+    async with pool.acquire() as conn:
+        marks = dict(await conn.fetch("SELECT table_name, max(bucket) FROM metric_rollup GROUP BY 1"))
+    for T in tables:
+        start = marks.get(T)
+        start = floor if start is None else max(floor, start + timedelta(seconds=BUCKET_SECS))
+        if start >= closed:
+            continue
+        try:
+            async with pool.acquire() as conn:
+                await conn.execute(ROLLUP_SQL.format(T=T, b=BUCKET_SECS), T, start, closed)
+        except Exception as e:
+            log.error(f"Rollup {T}: {e}")
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM metric_rollup WHERE bucket < $1", floor)
+
+def fit_trends(series_idx, t_hours, values, n_series, halflife_hours=HALFLIFE_HOURS):
+    """
+    Recency-weighted least squares for every series at once.
+    Inputs are flat arrays (series index, hours relative to now — ≤ 0, value);
+    returns (current fitted value, slope per hour, point count) per series.
+    """
+    w = np.power(0.5, -t_hours / halflife_hours)
+    bc = lambda x: np.bincount(series_idx, weights=x, minlength=n_series)
+    sw, sx, sy = bc(w), bc(w * t_hours), bc(w * values)
+    sxx, sxy = bc(w * t_hours * t_hours), bc(w * t_hours * values)
+    points = np.bincount(series_idx, minlength=n_series)
+
+    denom = sw * sxx - sx * sx
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(np.abs(denom) > 1e-12, (sw * sxy - sx * sy) / denom, 0.0)
+        intercept = (sy - slope * sx) / sw          # fitted value at t = 0 (now)
+    return intercept, slope, points
+
+def hours_until(current, slope, limit):
+    """Hours until the fitted line crosses limit; 0 if already past, NaN if not heading there"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        h = (limit - current) / slope
+    h = np.where(current >= limit, 0.0, h)
+    return np.where((current < limit) & (slope <= 0), np.nan, h)
+
+async def forecast(pool):
+    now = time.time()
+    run_at = datetime.fromtimestamp(now, timezone.utc)
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT table_name, metric, extract(epoch FROM bucket)::float8 AS t, value
+            FROM metric_rollup
+            WHERE bucket >= NOW() - make_interval(hours => $1)
+              AND table_name IN (SELECT table_name FROM machine_registry)
+        """, LOOKBACK_HOURS)
+        try:
+            limits = {r["table_name"]: r for r in await conn.fetch(
+                "SELECT table_name, disk_threshold, temp_threshold FROM machine_alert_config")}
+        except asyncpg.PostgresError:
+            limits = {}
+    if not rows:
+        await prune_forecasts(pool, run_at)
+        return 0
+
+    keys = np.array([f"{r['table_name']}\x00{r['metric']}" for r in rows])
+    uniq, series_idx = np.unique(keys, return_inverse=True)
+    t_hours = (np.array([r["t"] for r in rows]) + BUCKET_SECS / 2 - now) / 3600.0
+    values = np.array([r["value"] for r in rows], dtype=float)
+
+    current, slope, points = fit_trends(series_idx, t_hours, values, len(uniq))
+
+    names = [k.split("\x00", 1) for k in uniq]
+    is_disk = np.array([m.startswith("disk:") for _, m in names])
+    threshold = np.array([
+        float((limits.get(T) or {}).get("disk_threshold" if d else "temp_threshold")
+              or DEFAULT_THRESHOLDS["disk" if d else "temp"])
+        for (T, _), d in zip(names, is_disk)])
+    to_threshold = hours_until(current, slope, threshold)
+    to_full = np.where(is_disk, hours_until(current, slope, 100.0), np.nan)
+
+    ok = points >= MIN_POINTS
+    nan_none = lambda x: None if np.isnan(x) else float(x)
+    out = [(T, m, float(current[i]), float(slope[i]), float(threshold[i]),
+            nan_none(to_threshold[i]), nan_none(to_full[i]), int(points[i]), run_at)
+           for i, (T, m) in enumerate(names) if ok[i]]
+
+    async with pool.acquire() as conn:
+        await conn.executemany("""
+            INSERT INTO metric_forecasts (table_name, metric, current_value, slope_per_hour, threshold,
+                                          hours_to_threshold, hours_to_full, points, updated_at)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+            ON CONFLICT (table_name, metric) DO UPDATE SET
+                current_value = EXCLUDED.current_value, slope_per_hour = EXCLUDED.slope_per_hour,
+                threshold = EXCLUDED.threshold, hours_to_threshold = EXCLUDED.hours_to_threshold,
+                hours_to_full = EXCLUDED.hours_to_full, points = EXCLUDED.points, updated_at = EXCLUDED.updated_at
+        """, out)
+    await prune_forecasts(pool, run_at)
+    return len(out)
+
+async def prune_forecasts(pool, run_at):
+    """Drop series this run didn't refresh — unmounted partitions, removed machines, too few points"""
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM metric_forecasts WHERE updated_at < $1", run_at)
+
+async def main():
+    log.info("🚀 Forecaster starting...")
+    pool = await asyncpg.create_pool(
+        host=DB_HOST, port=DB_PORT, database=DB_NAME,
+        user=DB_USER, password=DB_PASS,
+        min_size=2, max_size=5
+    )
+    async with pool.acquire() as conn:
+        await conn.execute(SCHEMA)
+    log.info(f"✅ Connected — forecasting every {INTERVAL_SECS}s")
+
+    while True:
+        try:
+            started = time.monotonic()
+            async with pool.acquire() as conn:
+                tables = [r["table_name"] for r in await conn.fetch("SELECT table_name FROM machine_registry")]
+            await rollup(pool, tables)
+            rolled = time.monotonic()
+            n = await forecast(pool)
+            log.info(f"📈 {n} series across {len(tables)} machines "
+                     f"(rollup {rolled - started:.1f}s, fit {time.monotonic() - rolled:.1f}s)")
+        except Exception as e:
+            log.error(f"Forecast error: {e}")
+
+        await asyncio.sleep(INTERVAL_SECS)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,7 +3,10 @@ REFORMMED Monitor API — Receives metrics from agents
 """
 from fastapi import FastAPI, HTTPException, Header, Request
 from datetime import datetime, timezone
-import asyncpg, logging, os
+import asyncio, asyncpg, logging, math, os, re, time
+
+import process_index
+from result_cache import BucketCache, FIELDS, MAX_BUCKETS
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("api")
@@ -18,6 +21,9 @@ DB_PASS = os.getenv("POSTGRES_PASSWORD", "monitor2345")
 API_SECRET = os.getenv("API_SECRET", "")
 
 pool = None
+proc_index = process_index.ProcessIndex()
+history_cache = BucketCache()
+TABLE_RE = re.compile(r"^machine_[a-z0-9_]+$")
 
 @app.on_event("startup")
 async def startup():
@@ -27,11 +33,24 @@ async def startup():
         user=DB_USER, password=DB_PASS,
         min_size=5, max_size=20
     )
+    async with pool.acquire() as conn:
+        await process_index.ensure_schema(conn)
+    asyncio.create_task(sweep_process_index())
     log.info(f"✅ Connected to database at {DB_HOST}")
 
+async def sweep_process_index():
+    """Mark processes stopped on machines that no longer send metrics"""
+    while True:
+        await asyncio.sleep(process_index.GONE_SECS)
+        try:
+            async with pool.acquire() as conn:
+                await process_index.write(conn, proc_index, proc_index.sweep())
+        except Exception as e:
+            log.error(f"Process index sweep error: {e}")
+
 @app.get("/health")
 async def health():
-    return {"status": "ok", "time": datetime.now(timezone.utc).isoformat()}
+    return {"status": "ok", "time": datetime.now(timezone.utc).isoformat(), "cache": history_cache.stats()}
 
 @app.post("/register")
 async def register(request: Request, x_api_key: str = Header(...)):
@@ -127,7 +146,7 @@ async def metrics(request: Request, x_api_key: str = Header(...)):
         """, table_name, data.get("public_ip"), data.get("hostname"))
         
         # Insert metrics
-        await conn.execute(f"""
+        ts = await conn.fetchval(f"""
             INSERT INTO {table_name} (
                 cpu_percent, cpu_per_core, cpu_freq_mhz, cpu_temp,
                 ram_total_gb, ram_used_gb, ram_percent,
@@ -138,7 +157,7 @@ async def metrics(request: Request, x_api_key: str = Header(...)):
             ) VALUES (
                 $1, $2, $3, $4, $5, $6, $7, $8, $9, $10,
                 $11, $12, $13, $14, $15, $16, $17, $18, $19, $20, $21, $22, $23, $24
-            )
+            ) RETURNING ts
         """, 
         data.get("cpu_percent"), data.get("cpu_per_core"), data.get("cpu_freq_mhz"), data.get("cpu_temp"),
         data.get("ram_total_gb"), data.get("ram_used_gb"), data.get("ram_percent"),
@@ -147,6 +166,11 @@ async def metrics(request: Request, x_api_key: str = Header(...)):
         data.get("net_bytes_sent"), data.get("net_bytes_recv"), data.get("net_packets_sent"), data.get("net_packets_recv"),
         data.get("public_ip"), data.get("top_processes"), data.get("uptime_seconds"), 
         data.get("boot_time"), data.get("os_version"), data.get("hostname"), data.get("status"))
+
+        history_cache.invalidate(table_name, ts.timestamp())
+
+        # Fold into the fleet process index — only material changes are written
+        await process_index.write(conn, proc_index, proc_index.observe(table_name, data.get("top_processes")))
     
     return {"status": "ok"}
 
@@ -159,6 +183,47 @@ async def list_machines(x_api_key: str = Header(...)):
         rows = await conn.fetch("SELECT * FROM machine_registry ORDER BY id")
         return [dict(r) for r in rows]
 
+@app.get("/machines/{table_name}/history")
+async def machine_history(table_name: str, minutes: int = 30, bucket: int | None = None,
+                          fields: str = "cpu_percent,ram_percent", x_api_key: str = Header(...)):
+    if x_api_key != API_SECRET:
+        raise HTTPException(401, "Invalid API key")
+    
+    wanted = [f.strip() for f in fields.split(",") if f.strip()]
+    if not wanted or any(f not in FIELDS for f in wanted):
+        raise HTTPException(400, f"fields must be a subset of: {', '.join(sorted(FIELDS))}")
+    if not TABLE_RE.match(table_name) or minutes < 1 or (bucket is not None and bucket < 1):
+        raise HTTPException(400, "invalid table_name, bucket or minutes")
+    if bucket is None:
+        bucket = max(5, math.ceil(minutes * 60 / MAX_BUCKETS))   # widen buckets for long ranges
+    elif minutes * 60 / bucket > MAX_BUCKETS:
+        raise HTTPException(400, f"at most {MAX_BUCKETS} buckets per request — raise bucket or lower minutes")
+    
+    async with pool.acquire() as conn:
+        if not await conn.fetchval("SELECT 1 FROM machine_registry WHERE table_name=$1", table_name):
+            raise HTTPException(404, "Unknown machine")
+        buckets = await history_cache.history(conn, table_name, wanted, bucket, time.time() - minutes * 60)
+    
+    return [{"time": datetime.fromtimestamp(b, timezone.utc).isoformat(), **values} for b, values in buckets]
+
+@app.get("/processes/{name}")
+async def find_process(name: str, hours: float = 24, x_api_key: str = Header(...)):
+    if x_api_key != API_SECRET:
+        raise HTTPException(401, "Invalid API key")
+    
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT mr.system_name, mr.location, pi.table_name, pi.process_name,
+                   pi.running AND pi.last_seen >= NOW() - make_interval(secs => $3) AS running,
+                   pi.first_seen, pi.last_seen, pi.samples, pi.cpu_avg, pi.mem_avg, pi.cpu_peak, pi.mem_peak
+            FROM process_index pi
+            LEFT JOIN machine_registry mr ON mr.table_name = pi.table_name
+            WHERE lower(pi.process_name) = lower($1)
+              AND pi.last_seen >= NOW() - make_interval(secs => $2)
+            ORDER BY pi.cpu_avg DESC
+        """, name, hours * 3600, process_index.FLUSH_SECS + process_index.GONE_SECS)
+        return [dict(r) for r in rows]
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,296 @@
+"""
+REFORMMED Alert Notifier — Queues alerts, coalesces storms into digests, sends over one SMTP session
+"""
+import asyncio, logging, smtplib, time, os
+from collections import deque, Counter
+from email.mime.text import MIMEText
+from datetime import datetime, timezone
+
+log = logging.getLogger("notifier")
+
+COALESCE_SECS   = float(os.getenv("ALERT_COALESCE_SECS", "5"))
+MAX_RETRIES     = int(os.getenv("SMTP_MAX_RETRIES", "3"))
+SMTP_IDLE_SECS  = float(os.getenv("SMTP_IDLE_SECS", "60"))
+RECIPIENTS_TTL  = 60
+REQUEUE_DELAY_SECS   = 5
+HISTORY_BACKLOG_MAX  = 10000
+
+SUBJECTS = {
+    "offline": "🔴 OFFLINE: {machine} ({location})",
+    "online":  "🟢 ONLINE: {machine} ({location})",
+    "cpu":     "⚠️ HIGH CPU: {machine} — {value}%",
+    "ram":     "⚠️ HIGH RAM: {machine} — {value}%",
+    "disk":    "💾 DISK FULL: {machine} — {value}%",
+    "temp":    "🌡 HIGH TEMP: {machine} — {value}°C",
+    "forecast": "⏳ FORECAST: {machine} reaches threshold in {value}h",
+}
+
+async def load_smtp_config(conn):
+    """SMTP settings from system_config, falling back to environment variables"""
+    cfg = {
+        "smtp_host": os.getenv("SMTP_HOST", "smtp.gmail.com"),
+        "smtp_port": os.getenv("SMTP_PORT", "465"),
+        "gmail_user": os.getenv("GMAIL_USER", ""),
+        "gmail_app_password": os.getenv("GMAIL_APP_PASS", ""),
+    }
+    try:
+        rows = await conn.fetch(
+            "SELECT config_key, config_value FROM system_config WHERE config_key = ANY($1::text[])",
+            list(cfg))
+        cfg.update({r["config_key"]: r["config_value"] for r in rows if r["config_value"]})
+    except Exception as e:
+        log.warning(f"system_config unavailable, using environment: {e}")
+    # Env overrides win so a local SMTP stand-in can be pointed at without touching the DB
+    for key, env in (("smtp_host", "SMTP_HOST"), ("smtp_port", "SMTP_PORT"),
+                     ("gmail_user", "GMAIL_USER"), ("gmail_app_password", "GMAIL_APP_PASS")):
+        if os.getenv(env):
+            cfg[key] = os.getenv(env)
+    return {
+        "host": cfg["smtp_host"],
+        "port": int(cfg["smtp_port"]),
+        "user": cfg["gmail_user"],
+        "password": cfg["gmail_app_password"],
+        "ssl": os.getenv("SMTP_SSL", "1" if int(cfg["smtp_port"]) == 465 else "0") == "1",
+    }
+
+class SMTPSender:
+    """One reused SMTP session; reconnects when dropped or idle too long"""
+
+    def __init__(self, host, port, user="", password="", ssl=True, sender=None):
+        self.host, self.port = host, port
+        self.user, self.password = user, password
+        self.ssl = ssl
+        self.sender = sender or user or "monitor@localhost"
+        self._smtp = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        """Handshake on a local session; it only becomes the shared one once fully set up"""
+        cls = smtplib.SMTP_SSL if self.ssl else smtplib.SMTP
+        smtp = cls(self.host, self.port, timeout=15)
+        try:
+            smtp.ehlo_or_helo_if_needed()
+            if not self.ssl and smtp.has_extn("starttls"):
+                smtp.starttls()
+                smtp.ehlo()
+            if self.user and smtp.has_extn("auth"):
+                smtp.login(self.user, self.password)
+            elif self.user:
+                log.warning(f"{self.host}:{self.port} does not offer AUTH — sending without login")
+        except Exception:
+            try:
+                smtp.quit()
+            except Exception:
+                smtp.close()
+            raise
+        self._smtp = smtp
+        log.info(f"📨 SMTP connected to {self.host}:{self.port}")
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def send(self, to, subject, body):
+        """Blocking send — call from a worker thread"""
+        if self._smtp is not None and time.monotonic() - self._last_used > SMTP_IDLE_SECS:
+            self.close()
+        if self._smtp is None:
+            self._connect()
+        msg = MIMEText(body)
+        msg["Subject"] = subject
+        msg["From"] = self.sender
+        msg["To"] = to
+        try:
+            self._smtp.sendmail(self.sender, [to], msg.as_string())
+        except (smtplib.SMTPServerDisconnected, OSError):
+            self._smtp = None
+            raise
+        self._last_used = time.monotonic()
+
+class Notifier:
+    """Async alert queue: routes per recipient, coalesces bursts into digests, records alert_history"""
+
+    def __init__(self, pool, sender, coalesce_secs=COALESCE_SECS, max_retries=MAX_RETRIES):
+        self.pool = pool
+        self.sender = sender
+        self.coalesce_secs = coalesce_secs
+        self.max_retries = max_retries
+        self.queue = asyncio.Queue()
+        self._recipients = []
+        self._recipients_at = 0.0
+        self._history_backlog = []
+        self._latencies = deque(maxlen=500)
+        self._sent = self._failed = self._digests = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await asyncio.to_thread(self.sender.close)
+
+    def notify(self, machine_table, machine_name, location, alert_type,
+               value=None, threshold=None, custom_recipients=None, message=None):
+        """Queue an alert; never blocks the caller"""
+        self.queue.put_nowait({
+            "machine_table": machine_table,
+            "machine_name": machine_name,
+            "location": location,
+            "alert_type": alert_type,
+            "value": value,
+            "threshold": threshold,
+            "custom_recipients": custom_recipients,
+            "message": message,
+            "raised_at": datetime.now(timezone.utc),
+            "queued_at": time.monotonic(),
+        })
+
+    def stats(self):
+        lat = sorted(self._latencies)
+        pct = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))], 3) if lat else None
+        return {
+            "queue_depth": self.queue.qsize(),
+            "history_pending": len(self._history_backlog),
+            "sent": self._sent,
+            "failed": self._failed,
+            "digests": self._digests,
+            "latency_p50_s": pct(0.50),
+            "latency_p95_s": pct(0.95),
+            "latency_max_s": round(lat[-1], 3) if lat else None,
+        }
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            # Hold the window open so a site-wide outage lands in one digest per recipient
+            await asyncio.sleep(self.coalesce_secs)
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                # Nothing was sent yet — put the alerts back rather than lose them
+                log.error(f"Notify error, re-queuing {len(batch)} alerts: {e}")
+                for alert in batch:
+                    self.queue.put_nowait(alert)
+                await asyncio.sleep(REQUEUE_DELAY_SECS)
+
+    async def _load_recipients(self):
+        if time.monotonic() - self._recipients_at < RECIPIENTS_TTL:
+            return self._recipients
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(
+                    "SELECT email, receive_all_alerts, locations FROM email_recipients WHERE enabled")
+        except Exception as e:
+            if not self._recipients_at:
+                raise
+            log.warning(f"Recipient lookup failed, using cached list: {e}")
+            return self._recipients
+        self._recipients = [(r["email"], r["receive_all_alerts"], set(r["locations"] or [])) for r in rows]
+        self._recipients_at = time.monotonic()
+        return self._recipients
+
+    def _route(self, alert, recipients):
+        if alert["custom_recipients"]:
+            return list(alert["custom_recipients"])
+        return [email for email, all_alerts, locations in recipients
+                if all_alerts or alert["location"] in locations]
+
+    async def _flush(self, batch):
+        recipients = await self._load_recipients()
+        per_recipient = {}
+        routed = []
+        for alert in batch:
+            to = self._route(alert, recipients)
+            routed.append((alert, to))
+            for email in to:
+                per_recipient.setdefault(email, []).append(alert)
+
+        delivered = set()
+        for email, alerts in per_recipient.items():
+            subject, body = render_digest(alerts)
+            if await self._send_with_retry(email, subject, body):
+                delivered.add(email)
+                self._digests += 1
+                now = time.monotonic()
+                self._latencies.extend(now - a["queued_at"] for a in alerts)
+
+        rows = []
+        for alert, to in routed:
+            got = [e for e in to if e in delivered]
+            if got:
+                self._sent += 1
+            elif to:
+                self._failed += 1
+            rows.append((alert["machine_table"], alert["machine_name"], alert["alert_type"],
+                         alert["value"], alert["threshold"], got))
+        await self._record(rows)
+        log.info(f"📬 {len(batch)} alerts → {len(delivered)}/{len(per_recipient)} digests sent")
+
+    async def _record(self, rows):
+        """Write alert_history; rows that fail are kept and retried with the next batch"""
+        self._history_backlog.extend(rows)
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.executemany("""
+                    INSERT INTO alert_history (machine_table, machine_name, alert_type, alert_value, threshold, recipients)
+                    VALUES ($1, $2, $3, $4, $5, $6)
+                """, self._history_backlog)
+            self._history_backlog = []
+        except Exception as e:
+            del self._history_backlog[:-HISTORY_BACKLOG_MAX]
+            log.error(f"alert_history write failed, {len(self._history_backlog)} rows pending: {e}")
+
+    async def _send_with_retry(self, to, subject, body):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                await asyncio.to_thread(self.sender.send, to, subject, body)
+                return True
+            except Exception as e:
+                log.warning(f"SMTP send to {to} failed (attempt {attempt}/{self.max_retries}): {e}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(2 ** (attempt - 1))
+        log.error(f"❌ Giving up on {to}: {subject}")
+        return False
+
+def format_subject(alert):
+    template = SUBJECTS.get(alert["alert_type"], "🔔 {type}: {machine} ({location})")
+    value = alert["value"]
+    return template.format(machine=alert["machine_name"], location=alert["location"],
+                           type=alert["alert_type"].upper(),
+                           value=round(value, 1) if isinstance(value, (int, float)) else value)
+
+def render_digest(alerts):
+    """One alert keeps its own subject; several become a single digest grouped by location"""
+    if len(alerts) == 1:
+        a = alerts[0]
+        return format_subject(a), a["message"] or f"{format_subject(a)}\nRaised at {a['raised_at'].isoformat()}"
+
+    counts = Counter(a["alert_type"].upper() for a in alerts)
+    summary = ", ".join(f"{n}× {t}" for t, n in counts.most_common())
+    subject = f"🔔 REFORMMED: {len(alerts)} alerts ({summary})"
+
+    lines = [subject, ""]
+    by_location = {}
+    for a in alerts:
+        by_location.setdefault(a["location"], []).append(a)
+    for location in sorted(by_location):
+        lines.append(f"── {location} ({len(by_location[location])})")
+        for a in by_location[location]:
+            lines.append(f"  {a['raised_at'].strftime('%H:%M:%S')}  {format_subject(a)}")
+            if a["message"]:
+                lines.extend(f"            {line}" for line in a["message"].splitlines())
+        lines.append("")
+    return subject, "\n".join(lines)
@@ -1,10 +1,13 @@
 """
-REFORMMED Alert Checker — Simple version reading from environment variables
+REFORMMED Alert Checker — Detects offline/online transitions and hands alerts to the notifier
 """
-import asyncio, logging, smtplib, os
-from email.mime.text import MIMEText
+import asyncio, logging, os
 from datetime import datetime, timezone, timedelta
 import asyncpg
+import numpy as np
+
+import anomaly
+from notifier import Notifier, SMTPSender, load_smtp_config
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [ALERT] %(message)s")
 log = logging.getLogger("checker")
@@ -15,6 +18,128 @@ DB_NAME = os.getenv("POSTGRES_DB", "monitor_machine")
 DB_USER = os.getenv("POSTGRES_USER", "reformmed")
 DB_PASS = os.getenv("POSTGRES_PASSWORD", "monitor2345")
 
+OFFLINE_AFTER_SECS = int(os.getenv("OFFLINE_AFTER_SECS", "10"))
+STATS_EVERY_SECS   = 60
+FORECAST_EVERY_SECS = 300
+FORECAST_ALERT_HOURS = float(os.getenv("FORECAST_ALERT_HOURS", "24"))
+ANOMALY_EVERY_SECS = int(os.getenv("ANOMALY_EVERY_SECS", "30"))
+CHECKPOINT_EVERY_SECS = 300
+ANOMALY_COOLDOWN_SECS = int(os.getenv("ALERT_COOLDOWN_MINUTES", "10")) * 60
+LATEST_BATCH = 200
+
+async def check_machines(pool, notifier, last_status):
+    """Compare each machine's last_seen against the offline window and alert on transitions"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=OFFLINE_AFTER_SECS)
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT mr.table_name, mr.system_name, mr.location, mr.last_seen, mr.status,
+                   COALESCE(mas.alerts_enabled, true) AS alerts_enabled,
+                   COALESCE(mas.send_offline_alerts, true) AS send_offline_alerts,
+                   COALESCE(mas.send_online_alerts, true) AS send_online_alerts,
+                   mas.custom_recipients
+            FROM machine_registry mr
+            LEFT JOIN machine_alert_settings mas ON mr.table_name = mas.table_name
+        """)
+        went_offline = []
+        for r in rows:
+            T = r["table_name"]
+            status = "online" if r["last_seen"] and r["last_seen"] >= cutoff else "offline"
+            # After a restart the registry still holds the status written before it
+            previous = last_status.get(T, r["status"])
+            last_status[T] = status
+            if previous is None or previous == status:
+                continue
+            if status == "offline":
+                went_offline.append(T)
+            if not r["alerts_enabled"] or not r[f"send_{status}_alerts"]:
+                continue
+            notifier.notify(T, r["system_name"], r["location"], status,
+                            custom_recipients=r["custom_recipients"])
+        if went_offline:
+            await conn.execute(
+                "UPDATE machine_registry SET status='offline' WHERE table_name = ANY($1::text[])",
+                went_offline)
+    return len(rows)
+
+async def check_forecasts(pool, notifier, forecast_alerted):
+    """Alert once when a forecaster projection says a threshold will be crossed soon"""
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT f.table_name, f.metric, f.hours_to_threshold, f.threshold,
+                   mr.system_name, mr.location, mas.custom_recipients,
+                   COALESCE(mas.alerts_enabled, true) AND COALESCE(mas.send_threshold_alerts, true) AS enabled
+            FROM metric_forecasts f
+            JOIN machine_registry mr ON mr.table_name = f.table_name
+            LEFT JOIN machine_alert_settings mas ON mas.table_name = f.table_name
+            WHERE f.hours_to_threshold IS NOT NULL AND f.hours_to_threshold > 0 AND f.hours_to_threshold < $1
+        """, FORECAST_ALERT_HOURS)
+    due = set()
+    for r in rows:
+        key = (r["table_name"], r["metric"])
+        due.add(key)
+        if key in forecast_alerted or not r["enabled"]:
+            continue
+        notifier.notify(r["table_name"], r["system_name"], r["location"], "forecast",
+                        value=r["hours_to_threshold"], threshold=r["threshold"],
+                        custom_recipients=r["custom_recipients"],
+                        message=f"{r['system_name']} ({r['location']}): {r['metric']} projected to reach "
+                                f"{r['threshold']:.0f} in {r['hours_to_threshold']:.1f} hours")
+    # Projections that recovered drop out, so they can alert again later
+    forecast_alerted.clear()
+    forecast_alerted.update(due)
+
+async def check_anomalies(pool, model, last_ts, flagged, now):
+    """Fold every sample that arrived since the last pass into the streaming baselines"""
+    since = datetime.now(timezone.utc) - timedelta(seconds=ANOMALY_EVERY_SECS)
+    async with pool.acquire() as conn:
+        names = dict(await conn.fetch("SELECT table_name, system_name FROM machine_registry"))
+        tables = list(names)
+        samples = []
+        for i in range(0, len(tables), LATEST_BATCH):
+            batch = tables[i:i + LATEST_BATCH]
+            samples += await conn.fetch(anomaly.new_rows_sql(batch), *(last_ts.get(T, since) for T in batch))
+        if not samples:
+            return 0
+
+        # Rank rows within each machine; each rank is one vectorized update with unique slots
+        samples.sort(key=lambda r: (r["table_name"], r["ts"]))
+        idx, values, hours, ranks, keys = [], [], [], [], []
+        rank, prev = 0, None
+        for r in samples:
+            T = r["table_name"]
+            rank = rank + 1 if T == prev else 0
+            prev = T
+            last_ts[T] = r["ts"]
+            for metric in anomaly.METRICS:
+                if r[metric] is not None:
+                    idx.append(model.slot((T, metric)))
+                    values.append(r[metric])
+                    hours.append(r["ts"].hour)
+                    ranks.append(rank)
+                    keys.append((T, metric))
+        if not idx:
+            return 0
+
+        idx, values, hours, ranks = np.array(idx), np.array(values, dtype=float), np.array(hours), np.array(ranks)
+        rows = []
+        for k in range(ranks.max() + 1):
+            layer = np.nonzero(ranks == k)[0]
+            score, fire = model.update(idx[layer], values[layer], hours[layer])
+            for j, z in zip(layer[fire], score[fire]):
+                key = keys[j]
+                if now - flagged.get(key, -ANOMALY_COOLDOWN_SECS) < ANOMALY_COOLDOWN_SECS:
+                    continue
+                flagged[key] = now
+                T, metric = key
+                rows.append((T, names.get(T, T), f"anomaly:{metric}", float(values[j]), float(z)))
+        if rows:
+            await conn.executemany("""
+                INSERT INTO alert_history (machine_table, machine_name, alert_type, alert_value, z_score, recipients)
+                VALUES ($1, $2, $3, $4, $5, '{}')
+            """, rows)
+            log.info(f"📊 {len(rows)} anomalies flagged")
+    return len(samples)
+
 async def main():
     log.info("🚀 Alert Checker starting...")
     
@@ -25,12 +150,52 @@ async def main():
     )
     
     log.info("✅ Connected to database")
-    
+
+    async with pool.acquire() as conn:
+        smtp = await load_smtp_config(conn)
+    notifier = Notifier(pool, SMTPSender(**smtp))
+    notifier.start()
+    log.info(f"✅ Notifier ready ({smtp['host']}:{smtp['port']})")
+
+    model = anomaly.StreamingBaselines()
+    try:
+        async with pool.acquire() as conn:
+            await anomaly.ensure_schema(conn)
+            await anomaly.load(conn, model)
+    except Exception as e:
+        log.error(f"Anomaly state unavailable, starting cold: {e}")
+
+    last_status = {}
+    forecast_alerted = set()
+    anomaly_ts, anomaly_flagged = {}, {}
+    last_stats = last_forecast = last_anomaly = last_checkpoint = 0.0
+    loop = asyncio.get_running_loop()
+
     while True:
         try:
-            async with pool.acquire() as conn:
-                rows = await conn.fetch("SELECT * FROM machine_registry")
-                log.info(f"Checking {len(rows)} machines...")
+            n = await check_machines(pool, notifier, last_status)
+            if loop.time() - last_forecast >= FORECAST_EVERY_SECS:
+                last_forecast = loop.time()
+                try:
+                    await check_forecasts(pool, notifier, forecast_alerted)
+                except asyncpg.UndefinedTableError:
+                    pass  # forecaster hasn't created metric_forecasts yet
+            if loop.time() - last_anomaly >= ANOMALY_EVERY_SECS:
+                last_anomaly = loop.time()
+                try:
+                    await check_anomalies(pool, model, anomaly_ts, anomaly_flagged, last_anomaly)
+                except Exception as e:
+                    log.error(f"Anomaly check failed: {e}")
+            if loop.time() - last_checkpoint >= CHECKPOINT_EVERY_SECS and model.keys:
+                last_checkpoint = loop.time()
+                try:
+                    async with pool.acquire() as conn:
+                        await anomaly.checkpoint(conn, model)
+                except Exception as e:
+                    log.error(f"Anomaly checkpoint failed: {e}")
+            if loop.time() - last_stats >= STATS_EVERY_SECS:
+                log.info(f"Checked {n} machines — notifier {notifier.stats()}")
+                last_stats = loop.time()
             
             await asyncio.sleep(int(os.getenv("CHECK_INTERVAL_SECS", "3")))
         except Exception as e:
@@ -0,0 +1,150 @@
+"""
+REFORMMED Process Index — Fleet-wide (machine, process) inventory maintained at ingest time
+"""
+import json, logging, os, time
+from datetime import datetime, timezone
+
+log = logging.getLogger("process-index")
+
+CPU_DELTA  = float(os.getenv("PROC_INDEX_CPU_DELTA", "5"))    # percentage points
+MEM_DELTA  = float(os.getenv("PROC_INDEX_MEM_DELTA", "2"))
+FLUSH_SECS = float(os.getenv("PROC_INDEX_FLUSH_SECS", "60"))  # bound on last_seen staleness
+GONE_SECS  = float(os.getenv("PROC_INDEX_GONE_SECS", "30"))   # absence before marking stopped
+ALPHA      = 0.2                                              # EWMA weight of newest sample
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS process_index (
+        table_name TEXT NOT NULL,
+        process_name TEXT NOT NULL,
+        first_seen TIMESTAMPTZ NOT NULL,
+        last_seen TIMESTAMPTZ NOT NULL,
+        running BOOLEAN DEFAULT true,
+        samples BIGINT DEFAULT 0,
+        cpu_avg FLOAT,
+        mem_avg FLOAT,
+        cpu_peak FLOAT,
+        mem_peak FLOAT,
+        PRIMARY KEY (table_name, process_name)
+    );
+    CREATE INDEX IF NOT EXISTS idx_process_index_name ON process_index (lower(process_name), last_seen DESC);
+"""
+
+UPSERT = """
+    INSERT INTO process_index (table_name, process_name, first_seen, last_seen, running, samples,
+                               cpu_avg, mem_avg, cpu_peak, mem_peak)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+    ON CONFLICT (table_name, process_name) DO UPDATE SET
+        last_seen = GREATEST(process_index.last_seen, EXCLUDED.last_seen),
+        running   = EXCLUDED.running,
+        samples   = process_index.samples + EXCLUDED.samples,
+        cpu_avg   = EXCLUDED.cpu_avg,
+        mem_avg   = EXCLUDED.mem_avg,
+        cpu_peak  = GREATEST(process_index.cpu_peak, EXCLUDED.cpu_peak),
+        mem_peak  = GREATEST(process_index.mem_peak, EXCLUDED.mem_peak)
+"""
+
+def _float(v):
+    try:
+        return float(v or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def group_processes(top_processes):
+    """Collapse the sample's process list to {name: (cpu, mem)}, summing across PIDs"""
+    if isinstance(top_processes, str):
+        try:
+            top_processes = json.loads(top_processes)
+        except ValueError:
+            return {}
+    grouped = {}
+    for p in top_processes or []:
+        if not isinstance(p, dict) or not p.get("name"):
+            continue
+        cpu, mem = grouped.get(p["name"], (0.0, 0.0))
+        grouped[p["name"]] = (cpu + _float(p.get("cpu_percent")), mem + _float(p.get("mem_percent")))
+    return grouped
+
+class ProcessIndex:
+    """
+    In-memory per-machine process state; only material changes reach Postgres.
+    observe()/sweep() return rows without moving any watermark — commit() does that once
+    the rows are written, so a failed write is simply re-sent on the next sample.
+    """
+
+    def __init__(self):
+        self.machines = {}
+
+    def observe(self, table_name, top_processes, now=None):
+        """Fold one sample in and return the upsert rows it makes necessary"""
+        now = now or datetime.now(timezone.utc)
+        mono = time.monotonic()
+        state = self.machines.setdefault(table_name, {})
+        rows = []
+
+        for name, (cpu, mem) in group_processes(top_processes).items():
+            s = state.get(name)
+            if s is None:
+                state[name] = s = {"first_seen": now, "cpu": cpu, "mem": mem,
+                                   "cpu_peak": cpu, "mem_peak": mem, "samples": 0,
+                                   "w_cpu": None, "w_mem": None, "w_at": 0.0}
+            else:
+                s["cpu"] += ALPHA * (cpu - s["cpu"])
+                s["mem"] += ALPHA * (mem - s["mem"])
+                s["cpu_peak"] = max(s["cpu_peak"], cpu)
+                s["mem_peak"] = max(s["mem_peak"], mem)
+            s["running"] = True
+            s["samples"] += 1
+            s["last_seen"], s["seen_at"] = now, mono
+
+            if (s["w_cpu"] is None
+                    or abs(s["cpu"] - s["w_cpu"]) >= CPU_DELTA
+                    or abs(s["mem"] - s["w_mem"]) >= MEM_DELTA
+                    or mono - s["w_at"] >= FLUSH_SECS):
+                rows.append(_row(table_name, name, s))
+
+        return rows + self._expire(table_name, mono)
+
+    def sweep(self):
+        """Stopped-process rows for every machine, including ones that stopped sending"""
+        mono = time.monotonic()
+        return [row for table_name in list(self.machines) for row in self._expire(table_name, mono)]
+
+    def _expire(self, table_name, mono):
+        rows = []
+        for name, s in self.machines.get(table_name, {}).items():
+            if mono - s["seen_at"] >= GONE_SECS:
+                s["running"] = False
+                rows.append(_row(table_name, name, s))
+        return rows
+
+    def commit(self, rows):
+        """Advance watermarks for rows that reached Postgres; forget processes written as stopped"""
+        mono = time.monotonic()
+        for table_name, name, _, _, running, samples, cpu, mem, _, _ in rows:
+            state = self.machines.get(table_name, {})
+            s = state.get(name)
+            if s is None:
+                continue
+            if not running and not s["running"]:
+                del state[name]
+                continue
+            s["w_cpu"], s["w_mem"], s["w_at"] = cpu, mem, mono
+            s["samples"] -= samples
+
+def _row(table_name, name, s):
+    return (table_name, name, s["first_seen"], s["last_seen"], s["running"], s["samples"],
+            s["cpu"], s["mem"], s["cpu_peak"], s["mem_peak"])
+
+async def ensure_schema(conn):
+    await conn.execute(SCHEMA)
+
+async def write(conn, index, rows):
+    """Upsert rows and commit them to the index; never raises, so ingest can't fail on it"""
+    if not rows:
+        return
+    try:
+        await conn.executemany(UPSERT, rows)
+    except Exception as e:
+        log.error(f"Process index write failed ({len(rows)} rows, will retry): {e}")
+        return
+    index.commit(rows)
@@ -0,0 +1,117 @@
+"""
+REFORMMED Result Cache — Bucket-aligned LRU cache for machine history reads
+"""
+import logging, os, sys, time
+from collections import OrderedDict
+
+log = logging.getLogger("result-cache")
+
+MAX_BYTES  = int(float(os.getenv("RESULT_CACHE_MB", "64")) * 1024 * 1024)
+SETTLE_SECS = 2   # a bucket is only cached once it closed this long ago (in-flight inserts)
+MAX_BUCKETS = 2000  # per request — bounds both the scan and how much of the cache one read can evict
+
+# Numeric columns that may be requested as history fields
+FIELDS = {
+    "cpu_percent", "cpu_freq_mhz", "cpu_temp",
+    "ram_used_gb", "ram_percent", "swap_used_gb", "swap_percent",
+    "net_bytes_sent", "net_bytes_recv", "net_packets_sent", "net_packets_recv",
+    "uptime_seconds",
+}
+
+class BucketCache:
+    """
+    Completed buckets are immutable, so each one is cached under
+    (table, fields, bucket_secs, bucket_start) and reused as the read window slides.
+    Only missing buckets and the open trailing bucket are queried.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.by_table = {}        # table -> set of keys, for ingest invalidation
+        self.latest_end = {}      # table -> newest cached bucket end (epoch secs)
+        self.hits = self.misses = self.evictions = 0
+
+    @staticmethod
+    def _size(key, value):
+        return sys.getsizeof(key) + sys.getsizeof(value) + 24 * len(value or ())
+
+    def _put(self, key, value):
+        if key in self.entries:
+            return
+        size = self._size(key, value)
+        self.entries[key] = (value, size)
+        self.bytes += size
+        table, _, bucket_secs, start = key
+        self.by_table.setdefault(table, set()).add(key)
+        self.latest_end[table] = max(self.latest_end.get(table, 0), start + bucket_secs)
+        while self.bytes > self.max_bytes and self.entries:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _drop(self, key):
+        _, size = self.entries.pop(key)
+        self.bytes -= size
+        self.by_table.get(key[0], set()).discard(key)
+
+    def invalidate(self, table, since_epoch):
+        """
+        Called by ingest with the inserted row's ts: drop cached buckets that end after it.
+        Normally a no-op (new rows land in the open bucket); it matters when an insert
+        commits later than SETTLE_SECS after its ts was stamped.
+        """
+        if self.latest_end.get(table, 0) <= since_epoch:
+            return
+        for key in [k for k in self.by_table.get(table, ()) if k[2] + k[3] > since_epoch]:
+            self._drop(key)
+        self.latest_end[table] = since_epoch
+
+    async def history(self, conn, table, fields, bucket_secs, start, end=None):
+        """Return [(bucket_start, {field: avg})] for start..end, querying only what isn't cached"""
+        now = time.time()
+        end = min(end or now, now)
+        first = int(start // bucket_secs) * bucket_secs
+        closed_until = int((now - SETTLE_SECS) // bucket_secs) * bucket_secs
+        fields = tuple(sorted(fields))
+
+        result, missing = {}, []
+        for b in range(first, int(end) + 1, bucket_secs):
+            key = (table, fields, bucket_secs, b)
+            if b + bucket_secs <= closed_until and key in self.entries:
+                self.entries.move_to_end(key)
+                result[b] = self.entries[key][0]
+                self.hits += 1
+            else:
+                missing.append(b)
+                self.misses += 1
+
+        if missing:
+            fetched = await _query(conn, table, fields, bucket_secs, missing[0], missing[-1] + bucket_secs)
+            for b in missing:
+                value = fetched.get(b)
+                result[b] = value
+                if b + bucket_secs <= closed_until:
+                    self._put((table, fields, bucket_secs, b), value)
+
+        return [(b, result[b]) for b in sorted(result) if result[b] is not None]
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+async def _query(conn, table, fields, bucket_secs, start, end):
+    cols = ", ".join(f"avg({f}) AS {f}" for f in fields)
+    rows = await conn.fetch(f"""
+        SELECT (floor(extract(epoch FROM ts) / $3) * $3)::bigint AS bucket, {cols}
+        FROM {table}
+        WHERE ts >= to_timestamp($1) AND ts < to_timestamp($2)
+        GROUP BY 1 ORDER BY 1
+    """, start, end, bucket_secs)
+    return {r["bucket"]: {f: r[f] for f in fields} for r in rows}